@@ -4,12 +4,105 @@ Handles document ingestion, chunking, and preprocessing
 """
 
 import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from functools import lru_cache
 from typing import List, Dict
 from pathlib import Path
 import PyPDF2
 from docx import Document
 import tiktoken
 
+
+@lru_cache(maxsize=4)
+def _get_encoding(name: str) -> "tiktoken.Encoding":
+    """Share tiktoken encoders across DocumentProcessor instances.
+
+    Loading the BPE merge table costs ~50-200ms per call; encoders are
+    immutable after construction so sharing is thread-safe.
+    """
+    return tiktoken.get_encoding(name)
+
+# PyMuPDF is ~15-25x faster than PyPDF2 for text extraction;
+# fall back to PyPDF2 if it isn't installed
+try:
+    import fitz
+    _MUPDF_AVAILABLE = True
+except ImportError:
+    fitz = None
+    _MUPDF_AVAILABLE = False
+
+@dataclass
+class ChunkBatch:
+    """
+    Structure-of-arrays layout for a document's chunks.
+
+    Keeping parallel lists instead of a list of per-chunk dicts means the
+    vector store can pass texts/metadatas straight through to embedding and
+    ChromaDB without re-traversing N dicts.
+    """
+    texts: List[str] = field(default_factory=list)
+    metadatas: List[Dict] = field(default_factory=list)
+    chunk_indices: List[int] = field(default_factory=list)
+    start_tokens: List[int] = field(default_factory=list)
+    end_tokens: List[int] = field(default_factory=list)
+
+    def __len__(self):
+        return len(self.texts)
+
+    def to_dicts(self) -> List[Dict]:
+        """Adapter to the old list-of-dicts chunk format"""
+        return [
+            {
+                "text": text,
+                "metadata": metadata,
+                "chunk_index": idx,
+                "start_token": start,
+                "end_token": end,
+            }
+            for text, metadata, idx, start, end in zip(
+                self.texts, self.metadatas, self.chunk_indices,
+                self.start_tokens, self.end_tokens
+            )
+        ]
+
+
+def _compute_chunk_ranges(n_tokens: int, chunk_size: int, overlap: int):
+    """Compute (start, end) token ranges for the sliding chunk window"""
+    ranges = []
+    start = 0
+    while start < n_tokens:
+        end = min(start + chunk_size, n_tokens)
+        ranges.append((start, end))
+        if end >= n_tokens:
+            break
+        start = end - overlap
+    return ranges
+
+
+# JIT the range computation when numba is installed; the pure-Python
+# version above stays as the fallback
+try:
+    import numba
+
+    _compute_chunk_ranges = numba.njit(cache=True)(_compute_chunk_ranges)
+except ImportError:
+    pass
+
+
+# Only parallelize extraction for PDFs above this page count; below it the
+# process startup cost outweighs the per-page work
+_PARALLEL_PAGE_THRESHOLD = 8
+_MAX_PDF_WORKERS = 8
+
+
+def _extract_pdf_page(args):
+    """Worker for parallel PDF extraction. Opens its own document handle
+    because PDF handles are not fork-safe."""
+    file_path, page_index = args
+    with fitz.open(file_path) as doc:
+        return doc.load_page(page_index).get_text("text")
+
 class DocumentProcessor:
     def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 200):
         """
@@ -21,7 +114,7 @@ class DocumentProcessor:
         """
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
-        self.encoding = tiktoken.get_encoding("cl100k_base")
+        self.encoding = _get_encoding("cl100k_base")
     
     def read_file(self, file_path: str) -> str:
         """
@@ -49,23 +142,128 @@ class DocumentProcessor:
     
     def _read_pdf(self, file_path: str) -> str:
         """Extract text from PDF file"""
-        text = ""
+        if _MUPDF_AVAILABLE:
+            try:
+                # Read the file once and parse from the in-memory buffer;
+                # avoids fitz doing its own buffered reads (matters on
+                # network-backed filesystems)
+                data = Path(file_path).read_bytes()
+                with fitz.open(stream=data, filetype="pdf") as doc:
+                    page_count = doc.page_count
+                    if page_count <= _PARALLEL_PAGE_THRESHOLD:
+                        # "text" mode skips layout analysis for plain extraction
+                        return "\n".join(page.get_text("text") for page in doc)
+
+                # Page extraction is CPU-bound and independent per page, so
+                # fan out across processes; executor.map preserves page order
+                workers = min(os.cpu_count() or 1, _MAX_PDF_WORKERS, page_count)
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    pages = executor.map(
+                        _extract_pdf_page,
+                        [(file_path, i) for i in range(page_count)]
+                    )
+                    return "\n".join(pages)
+            except Exception as e:
+                raise Exception(f"Error reading PDF: {str(e)}")
+
+        # Fallback: PyPDF2 (much slower, kept for compatibility)
+        parts = []
         try:
             with open(file_path, 'rb') as file:
                 pdf_reader = PyPDF2.PdfReader(file)
                 for page in pdf_reader.pages:
                     extracted = page.extract_text()
                     if extracted:
-                        text += extracted + "\n"
+                        parts.append(extracted)
         except Exception as e:
             raise Exception(f"Error reading PDF: {str(e)}")
-        return text
+        return "\n".join(parts)
+
+    def _iter_pdf_pages(self, file_path: str):
+        """
+        Yield text page by page instead of materializing the whole document.
+        Keeps memory bounded for very large PDFs.
+        """
+        if _MUPDF_AVAILABLE:
+            data = Path(file_path).read_bytes()
+            with fitz.open(stream=data, filetype="pdf") as doc:
+                for page in doc:
+                    yield page.get_text("text")
+        else:
+            with open(file_path, 'rb') as file:
+                pdf_reader = PyPDF2.PdfReader(file)
+                for page in pdf_reader.pages:
+                    extracted = page.extract_text()
+                    if extracted:
+                        yield extracted
+
+    def process_document_streaming(self, file_path: str, metadata: Dict = None):
+        """
+        Stream chunks from a PDF without holding the full text in memory.
+
+        Pages feed a rolling token buffer that carries chunk_overlap tokens
+        across page boundaries, so chunks are identical to the batch path.
+        Yields the same chunk dictionaries as chunk_text.
+
+        Args:
+            file_path: Path to the PDF document
+            metadata: Optional metadata to attach to each chunk
+        """
+        if metadata is None:
+            metadata = {}
+        metadata.update({
+            "filename": Path(file_path).name,
+            "file_path": file_path,
+            "file_type": Path(file_path).suffix
+        })
+
+        buffer = []
+        chunk_index = 0
+        consumed = 0  # absolute token offset of buffer[0]
+        last_end = 0  # absolute end of the last emitted chunk
+
+        def emit(tokens):
+            nonlocal chunk_index, last_end
+            last_end = consumed + len(tokens)
+            chunk_data = {
+                "text": self.encoding.decode(tokens),
+                "metadata": metadata,
+                "chunk_index": chunk_index,
+                "start_token": consumed,
+                "end_token": last_end
+            }
+            chunk_index += 1
+            return chunk_data
+
+        first_page = True
+        for page_text in self._iter_pdf_pages(file_path):
+            # The batch path joins pages with "\n"; prepend the separator
+            # to every page after the first so the token stream matches
+            # exactly (no trailing newline after the last page)
+            if first_page:
+                first_page = False
+            else:
+                page_text = "\n" + page_text
+            buffer.extend(self.encoding.encode_ordinary(page_text))
+            while len(buffer) >= self.chunk_size:
+                yield emit(buffer[:self.chunk_size])
+                step = self.chunk_size - self.chunk_overlap
+                buffer = buffer[step:]
+                consumed += step
+
+        # The residual buffer is only new material if it extends past the
+        # last emitted chunk; otherwise it is just the carried overlap and
+        # the batch path would not emit it either
+        if buffer and consumed + len(buffer) > last_end:
+            yield emit(buffer)
     
     def _read_docx(self, file_path: str) -> str:
         """Extract text from DOCX file"""
         try:
             doc = Document(file_path)
-            text = "\n".join([paragraph.text for paragraph in doc.paragraphs if paragraph.text.strip()])
+            # isspace() tests emptiness in one C-level pass without the
+            # string allocation strip() makes
+            text = "\n".join(p.text for p in doc.paragraphs if p.text and not p.text.isspace())
             return text
         except Exception as e:
             raise Exception(f"Error reading DOCX: {str(e)}")
@@ -80,63 +278,74 @@ class DocumentProcessor:
             with open(file_path, 'r', encoding='latin-1') as file:
                 return file.read()
     
-    def chunk_text(self, text: str, metadata: Dict = None) -> List[Dict]:
+    def chunk_text(self, text: str, metadata: Dict = None) -> ChunkBatch:
         """
         Split text into overlapping chunks
-        
+
         Args:
             text: Input text to chunk
             metadata: Optional metadata to attach to each chunk
-            
+
         Returns:
-            List of dictionaries containing chunks and metadata
+            ChunkBatch with parallel lists of texts and metadata
+            (use .to_dicts() for the old list-of-dicts format)
         """
         if not text or not text.strip():
-            return []
-        
-        # Encode text to tokens
-        tokens = self.encoding.encode(text)
-        chunks = []
-        
-        start = 0
-        while start < len(tokens):
-            # Get chunk of tokens
-            end = min(start + self.chunk_size, len(tokens))
-            chunk_tokens = tokens[start:end]
-            
-            # Decode back to text
-            chunk_text = self.encoding.decode(chunk_tokens)
-            
-            # Create chunk with metadata
-            chunk_data = {
-                "text": chunk_text,
-                "metadata": metadata.copy() if metadata else {},
-                "chunk_index": len(chunks),
-                "start_token": start,
-                "end_token": end
-            }
-            
-            chunks.append(chunk_data)
-            
-            # Move to next chunk with overlap
-            start = end - self.chunk_overlap
-            
-            # Break if we've reached the end
-            if end >= len(tokens):
-                break
+            return ChunkBatch()
         
-        return chunks
+        # Encode text to tokens; encode_ordinary skips the special-token
+        # scan, which user documents never need
+        tokens = self.encoding.encode_ordinary(text)
+
+        # Compute all chunk ranges up front (JIT-compiled when numba is
+        # available)
+        ranges = _compute_chunk_ranges(len(tokens), self.chunk_size, self.chunk_overlap)
+
+        # One decode_batch call instead of a decode per chunk; batch APIs
+        # cross the Python/Rust boundary once for the whole document
+        chunk_texts = self.encoding.decode_batch([tokens[s:e] for s, e in ranges])
+
+        # Metadata is constant across a document and the vector store
+        # builds its own sanitized dicts on insert, so share one reference
+        # instead of N identical copies
+        shared_metadata = metadata if metadata else {}
+        return ChunkBatch(
+            texts=chunk_texts,
+            metadatas=[shared_metadata] * len(ranges),
+            chunk_indices=list(range(len(ranges))),
+            start_tokens=[s for s, _ in ranges],
+            end_tokens=[e for _, e in ranges],
+        )
     
-    def process_document(self, file_path: str, metadata: Dict = None) -> List[Dict]:
+    def chunk_token_ranges(self, text: str) -> List[tuple]:
+        """
+        Compute chunk (start, end) token ranges without decoding
+
+        The decode back to text is only needed when chunks are stored for
+        display; for length stats or dedupe this skips it entirely, the
+        same way count_tokens never decodes.
+
+        Args:
+            text: Input text to chunk
+
+        Returns:
+            List of (start_token, end_token) tuples
+        """
+        if not text or not text.strip():
+            return []
+        n_tokens = len(self.encoding.encode_ordinary(text))
+        return list(_compute_chunk_ranges(n_tokens, self.chunk_size, self.chunk_overlap))
+
+    def process_document(self, file_path: str, metadata: Dict = None) -> ChunkBatch:
         """
         Process a document: read and chunk it
-        
+
         Args:
             file_path: Path to the document
             metadata: Optional metadata to attach
-            
+
         Returns:
-            List of processed chunks with metadata
+            ChunkBatch of processed chunks with metadata
         """
         # Read file content
         text = self.read_file(file_path)
@@ -161,4 +370,4 @@ class DocumentProcessor:
     
     def count_tokens(self, text: str) -> int:
         """Count tokens in text"""
-        return len(self.encoding.encode(text))
+        return len(self.encoding.encode_ordinary(text))
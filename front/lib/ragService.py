@@ -3,6 +3,7 @@ RAG Service - Main orchestrator for Retrieval-Augmented Generation
 Combines document processing, vector search, and LLM generation
 """
 
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Optional
 import os
 import sys
@@ -84,7 +85,53 @@ class RAGService:
                 "chunks_created": 0
             }
     
-    def retrieve_context(self, 
+    def ingest_documents(self,
+                        file_paths: List[str],
+                        user_id: Optional[str] = None) -> List[Dict]:
+        """
+        Ingest a batch of documents with pipelined extraction and embedding
+
+        File reading/chunking runs in a thread pool while the main thread
+        embeds and inserts already-extracted documents, so I/O-bound
+        extraction overlaps the CPU/GPU-bound embedding stage.
+
+        Args:
+            file_paths: Paths to the documents to ingest
+            user_id: Optional user ID
+
+        Returns:
+            List of per-file ingestion results (same shape as ingest_document)
+        """
+        results = []
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            futures = [
+                pool.submit(self.doc_processor.process_document, path)
+                for path in file_paths
+            ]
+            # Consume in submission order: while we embed document i, the
+            # pool is already extracting documents i+1..i+4
+            for file_path, future in zip(file_paths, futures):
+                try:
+                    chunks = future.result()
+                    doc_ids = self.vector_store.add_documents(chunks, user_id)
+                    results.append({
+                        "success": True,
+                        "filename": os.path.basename(file_path),
+                        "chunks_created": len(chunks),
+                        "document_ids": doc_ids,
+                        "user_id": user_id
+                    })
+                except Exception as e:
+                    print(f"Error ingesting document {file_path}: {str(e)}")
+                    results.append({
+                        "success": False,
+                        "filename": os.path.basename(file_path),
+                        "error": str(e),
+                        "chunks_created": 0
+                    })
+        return results
+
+    def retrieve_context(self,
                         query: str, 
                         n_results: int = 5,
                         user_id: Optional[str] = None) -> List[Dict]:
@@ -192,9 +239,8 @@ Please provide a helpful answer based on the context above. If the context doesn
             if include_sources:
                 for doc in context_docs:
                     metadata = doc.get("metadata", {})
-                    text_preview = doc.get("text", "")[:200]
-                    if len(doc.get("text", "")) > 200:
-                        text_preview += "..."
+                    text = doc.get("text", "")
+                    text_preview = text[:200] + "..." if len(text) > 200 else text
                     
                     sources.append({
                         "filename": metadata.get("filename", "Unknown"),
@@ -5,11 +5,94 @@ Handles embedding generation and vector similarity search
 
 import chromadb
 from chromadb.config import Settings
+from collections import OrderedDict
 from typing import List, Dict, Optional
 from sentence_transformers import SentenceTransformer
+import threading
 import uuid
 import os
 
+try:
+    import torch
+except ImportError:
+    torch = None
+
+
+class _OnnxEmbedder:
+    """
+    Drop-in encode() replacement backed by ONNX Runtime.
+
+    Exports the sentence-transformers model to ONNX and applies int8
+    dynamic quantization, which is ~3-4x faster than PyTorch fp32 on CPU
+    with negligible quality loss. Selected via RAG_EMBED_BACKEND=onnx.
+    """
+
+    def __init__(self, model_name: str, cache_dir: str):
+        from transformers import AutoTokenizer
+        from optimum.onnxruntime import ORTModelForFeatureExtraction
+
+        model_id = model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+        self.tokenizer = AutoTokenizer.from_pretrained(model_id)
+
+        quantized_dir = os.path.join(cache_dir, "onnx_int8")
+        if not os.path.isdir(quantized_dir):
+            self._export_quantized(model_id, quantized_dir)
+        try:
+            # The export dir also holds the fp32 model.onnx the quantizer
+            # started from; name the int8 file explicitly or optimum loads
+            # the fp32 one
+            self.model = ORTModelForFeatureExtraction.from_pretrained(
+                quantized_dir, file_name="model_quantized.onnx",
+                provider="CPUExecutionProvider"
+            )
+            print("Loaded int8-quantized ONNX embedding model")
+        except Exception as e:
+            # Quantization is best-effort; plain ONNX export is still a win
+            print(f"Quantized model unavailable ({e}), using fp32 ONNX export")
+            self.model = ORTModelForFeatureExtraction.from_pretrained(
+                model_id, export=True, provider="CPUExecutionProvider"
+            )
+
+    @staticmethod
+    def _export_quantized(model_id: str, save_dir: str):
+        from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+        model = ORTModelForFeatureExtraction.from_pretrained(model_id, export=True)
+        model.save_pretrained(save_dir)
+        quantizer = ORTQuantizer.from_pretrained(save_dir)
+        quantizer.quantize(
+            save_dir=save_dir,
+            quantization_config=AutoQuantizationConfig.avx512_vnni(is_static=False)
+        )
+
+    def encode(self, texts, batch_size: int = 64, convert_to_numpy: bool = True,
+               normalize_embeddings: bool = False, show_progress_bar: bool = False):
+        import numpy as np
+
+        single = isinstance(texts, str)
+        if single:
+            texts = [texts]
+
+        parts = []
+        for i in range(0, len(texts), batch_size):
+            inputs = self.tokenizer(
+                texts[i:i + batch_size],
+                padding=True, truncation=True, max_length=256,
+                return_tensors="np"
+            )
+            hidden = self.model(**inputs).last_hidden_state
+            # Mean-pool over non-padding tokens
+            mask = inputs["attention_mask"][:, :, None].astype(hidden.dtype)
+            parts.append((hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9))
+
+        embeddings = np.concatenate(parts) if len(parts) > 1 else parts[0]
+        if normalize_embeddings:
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings = embeddings / np.maximum(norms, 1e-12)
+        return embeddings[0] if single else embeddings
+
+
 class VectorStore:
     def __init__(self, 
                  collection_name: str = "documents",
@@ -25,35 +108,99 @@ class VectorStore:
         """
         self.collection_name = collection_name
         self.persist_directory = persist_directory
-        
+        self.embedding_model_name = embedding_model
+
         # Create directory if it doesn't exist
         os.makedirs(persist_directory, exist_ok=True)
-        
-        # Initialize ChromaDB client
-        self.client = chromadb.PersistentClient(
-            path=persist_directory,
-            settings=Settings(
-                anonymized_telemetry=False,
-                allow_reset=True
-            )
-        )
-        
-        # Initialize embedding model
-        print(f"Loading embedding model: {embedding_model}")
-        self.embedding_model = SentenceTransformer(embedding_model)
-        print("Embedding model loaded successfully")
-        
-        # Get or create collection
+
+        # Model, client, and collection are loaded lazily so admin
+        # operations that never embed (list/delete) skip the cold start
+        self._embedding_model = None
+        self._client = None
+        self._collection = None
+        self._model_lock = threading.Lock()
+        self._store_lock = threading.Lock()
+
+        # LRU cache for query embeddings - chat UIs resend identical
+        # queries on retry/rerender, so cache hits skip the forward pass
+        self._query_cache = OrderedDict()
+        self._query_cache_size = 512
+
+        # Warm the embedding model in the background so it's usually
+        # ready by the time the first embed call arrives
+        threading.Thread(target=self._warm_up, daemon=True).start()
+
+    def _warm_up(self):
         try:
-            self.collection = self.client.get_collection(name=collection_name)
-            print(f"Loaded existing collection: {collection_name}")
-        except:
-            self.collection = self.client.create_collection(
-                name=collection_name,
-                metadata={"description": "Document embeddings for RAG"}
-            )
-            print(f"Created new collection: {collection_name}")
-    
+            _ = self.embedding_model
+        except Exception as e:
+            print(f"Background model load failed: {e}")
+
+    @property
+    def embedding_model(self):
+        if self._embedding_model is None:
+            with self._model_lock:
+                if self._embedding_model is None:
+                    if os.environ.get("RAG_EMBED_BACKEND", "").lower() == "onnx":
+                        try:
+                            self._embedding_model = _OnnxEmbedder(
+                                self.embedding_model_name, self.persist_directory
+                            )
+                            return self._embedding_model
+                        except Exception as e:
+                            print(f"ONNX backend unavailable ({e}), falling back to PyTorch")
+
+                    # RAG_EMBED_DEVICE overrides auto-detection (e.g. "cpu", "cuda:1")
+                    device = os.environ.get("RAG_EMBED_DEVICE")
+                    if not device:
+                        device = "cuda" if torch and torch.cuda.is_available() else "cpu"
+
+                    print(f"Loading embedding model: {self.embedding_model_name} on {device}")
+                    model = SentenceTransformer(self.embedding_model_name, device=device)
+                    if device.startswith("cuda"):
+                        # fp16 roughly doubles GPU throughput with negligible quality loss
+                        model.half()
+                        model.max_seq_length = 256
+                    print("Embedding model loaded successfully")
+                    self._embedding_model = model
+        return self._embedding_model
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._store_lock:
+                if self._client is None:
+                    self._client = chromadb.PersistentClient(
+                        path=self.persist_directory,
+                        settings=Settings(
+                            anonymized_telemetry=False,
+                            allow_reset=True
+                        )
+                    )
+        return self._client
+
+    @property
+    def collection(self):
+        if self._collection is None:
+            client = self.client  # resolve outside the lock (it's not reentrant)
+            with self._store_lock:
+                if self._collection is None:
+                    try:
+                        self._collection = client.get_collection(name=self.collection_name)
+                        print(f"Loaded existing collection: {self.collection_name}")
+                    except:
+                        self._collection = client.create_collection(
+                            name=self.collection_name,
+                            metadata={
+                                # normalized vectors + inner product == cosine, and IP
+                                # is cheaper than L2 at query time
+                                "hnsw:space": "ip",
+                                "description": "Document embeddings for RAG"
+                            }
+                        )
+                        print(f"Created new collection: {self.collection_name}")
+        return self._collection
+
     def generate_embedding(self, text: str) -> List[float]:
         """
         Generate embedding for a text
@@ -64,63 +211,101 @@ class VectorStore:
         Returns:
             Embedding vector
         """
-        embedding = self.embedding_model.encode(text, convert_to_numpy=True)
+        embedding = self.embedding_model.encode(
+            text, convert_to_numpy=True, normalize_embeddings=True
+        )
         return embedding.tolist()
+
+    def _embed_query(self, query: str) -> List[float]:
+        """Generate a query embedding, caching repeated queries in an LRU"""
+        key = query.strip().lower()
+        cached = self._query_cache.get(key)
+        if cached is not None:
+            self._query_cache.move_to_end(key)
+            return cached
+
+        embedding = self.generate_embedding(query)
+        self._query_cache[key] = embedding
+        if len(self._query_cache) > self._query_cache_size:
+            self._query_cache.popitem(last=False)
+        return embedding
     
-    def add_documents(self, chunks: List[Dict], user_id: Optional[str] = None) -> List[str]:
+    def add_documents(self, chunks, user_id: Optional[str] = None) -> List[str]:
         """
         Add document chunks to vector store
-        
+
         Args:
-            chunks: List of document chunks with text and metadata
+            chunks: ChunkBatch from DocumentProcessor, or a list of chunk
+                dicts with text and metadata (legacy format)
             user_id: Optional user ID to associate documents with
-            
+
         Returns:
             List of document IDs
         """
         if not chunks:
             return []
+
+        # ChunkBatch (structure-of-arrays) already holds the parallel lists
+        # ChromaDB wants; only the legacy list-of-dicts path re-traverses
+        if hasattr(chunks, "texts"):
+            documents = chunks.texts
+            raw_metadatas = chunks.metadatas
+            chunk_indices = chunks.chunk_indices
+        else:
+            documents = [chunk["text"] for chunk in chunks]
+            raw_metadatas = [chunk.get("metadata", {}) for chunk in chunks]
+            chunk_indices = [chunk.get("chunk_index", 0) for chunk in chunks]
+
+        # One urandom call per batch instead of one uuid4 syscall per
+        # chunk; sequential suffixes also give Chroma's sqlite index
+        # ordered insertions
+        base = uuid.uuid4().hex[:16]
+        ids = [f"{base}-{i:08x}" for i in range(len(documents))]
+
+        # ChromaDB requires all metadata values to be strings, ints, floats, or bools
+        user_extra = {"user_id": user_id} if user_id else {}
+        metadatas = [
+            {
+                **{
+                    key: value if isinstance(value, (str, int, float, bool)) else str(value)
+                    for key, value in raw.items()
+                },
+                **user_extra,
+                "chunk_index": int(idx),
+            }
+            for raw, idx in zip(raw_metadatas, chunk_indices)
+        ]
+
+        # Embed all chunks in one batched forward pass instead of one
+        # encode() call per chunk - this is where ingestion time goes
+        embeddings = self.embedding_model.encode(
+            documents,
+            batch_size=64,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        ).tolist()
         
-        # Prepare data for ChromaDB
-        ids = []
-        documents = []
-        embeddings = []
-        metadatas = []
-        
-        for chunk in chunks:
-            doc_id = str(uuid.uuid4())
-            ids.append(doc_id)
-            
-            documents.append(chunk["text"])
-            
-            # Generate embedding
-            embedding = self.generate_embedding(chunk["text"])
-            embeddings.append(embedding)
-            
-            # Prepare metadata - ChromaDB requires all values to be strings, ints, floats, or bools
-            metadata = {}
-            for key, value in chunk.get("metadata", {}).items():
-                if isinstance(value, (str, int, float, bool)):
-                    metadata[key] = value
-                else:
-                    metadata[key] = str(value)
-            
-            if user_id:
-                metadata["user_id"] = user_id
-            metadata["chunk_index"] = int(chunk.get("chunk_index", 0))
-            
-            metadatas.append(metadata)
-        
-        # Add to collection
-        self.collection.add(
-            ids=ids,
-            documents=documents,
-            embeddings=embeddings,
-            metadatas=metadatas
-        )
-        
+        # Add to collection in bounded batches
+        self._add_batched(ids, documents, embeddings, metadatas)
+
         print(f"Added {len(chunks)} chunks to vector store")
         return ids
+
+    def _add_batched(self, ids, documents, embeddings, metadatas, batch: int = 256):
+        """
+        Insert into the collection in fixed-size batches
+
+        Keeps very large documents under Chroma's internal batch limits
+        with stable memory, while still amortizing per-call overhead.
+        """
+        for i in range(0, len(ids), batch):
+            self.collection.add(
+                ids=ids[i:i + batch],
+                documents=documents[i:i + batch],
+                embeddings=embeddings[i:i + batch],
+                metadatas=metadatas[i:i + batch]
+            )
     
     def search(self, 
                query: str, 
@@ -139,8 +324,8 @@ class VectorStore:
         Returns:
             List of relevant documents with scores
         """
-        # Generate query embedding
-        query_embedding = self.generate_embedding(query)
+        # Generate query embedding (cached for repeated queries)
+        query_embedding = self._embed_query(query)
         
         # Prepare where filter
         where_filter = filter_metadata.copy() if filter_metadata else {}
@@ -251,9 +436,12 @@ class VectorStore:
         """Delete all documents from collection"""
         try:
             self.client.delete_collection(name=self.collection_name)
-            self.collection = self.client.create_collection(
+            self._collection = self.client.create_collection(
                 name=self.collection_name,
-                metadata={"description": "Document embeddings for RAG"}
+                metadata={
+                    "hnsw:space": "ip",
+                    "description": "Document embeddings for RAG"
+                }
             )
             print(f"Reset collection: {self.collection_name}")
         except Exception as e:
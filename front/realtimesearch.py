@@ -1,592 +1,1082 @@
-import os
-import time
-import json
-import hashlib
-import logging
-import requests
-import threading
-import datetime
-from urllib.parse import urlparse, urljoin
-from http import HTTPStatus
-from collections import defaultdict, Counter
-from typing import List, Dict, Tuple, Optional
-import re
-from dotenv import load_dotenv
-
-load_dotenv()
-
-try:
-    from bs4 import BeautifulSoup
-except Exception:
-    BeautifulSoup = None
-
-try:
-    import nltk
-    nltk_available = True
-except Exception:
-    nltk_available = False
-
-try:
-    from sklearn.feature_extraction.text import TfidfVectorizer
-    from sklearn.metrics.pairwise import cosine_similarity
-    sklearn_available = True
-except Exception:
-    sklearn_available = False
-
-logger = logging.getLogger("rtsearch")
-logger.setLevel(logging.DEBUG)
-ch = logging.StreamHandler()
-ch.setFormatter(logging.Formatter("%(asctime)s %(levelname)s: %(message)s"))
-logger.addHandler(ch)
-
-
-class PolicyProxy:
-    """
-    Simple policy proxy that enforces basic quotas, secrets, and logs.
-    In production this would be a networked service that validates outgoing requests.
-    """
-    def __init__(self, quotas: Dict[str,int] = None):
-        self.quotas = quotas or {"google_search_per_minute": 60}
-        self.counters = defaultdict(lambda: {"count": 0, "reset": time.time() + 60})
-        self.lock = threading.Lock()
-        
-        
-        self.vault = {
-            "GOOGLE_API_KEY": os.environ.get("REACT_APP_GOOGLE_API_KEY") or os.environ.get("GOOGLE_API_KEY", ""),
-            "SEARCH_ENGINE_ID": os.environ.get("REACT_APP_SEARCH_ENGINE_ID") or os.environ.get("SEARCH_ENGINE_ID", ""),
-            "SERPAPI_KEY": os.environ.get("SERPAPI_KEY", "")
-        }
-        
-        print(f"Loaded API Key: {'***' + self.vault['GOOGLE_API_KEY'][-4:] if self.vault['GOOGLE_API_KEY'] else 'MISSING'}")
-        print(f"Loaded Search Engine ID: {self.vault['SEARCH_ENGINE_ID'] if self.vault['SEARCH_ENGINE_ID'] else 'MISSING'}")
-
-    def check_and_consume(self, key_name:str, cost:int=1) -> bool:
-        
-        with self.lock:
-            bucket = self.counters[key_name]
-            if time.time() > bucket["reset"]:
-                bucket["count"] = 0
-                bucket["reset"] = time.time() + 60
-            if bucket["count"] + cost > self.quotas.get(key_name, 1000000):
-                logger.warning(f"Quota exceeded for {key_name}")
-                return False
-            bucket["count"] += cost
-            return True
-
-    def get_secret(self, name:str) -> str:
-        return self.vault.get(name,"")
-
-    def log_request(self, metadata:Dict):
-        logger.info(f"PolicyProxy log: {json.dumps(metadata)}")
-
-policy = PolicyProxy()
-
-
-class QueryPlanner:
-    """
-    Very simple planner: if query contains 'recent' or date words or 'latest', prefer search.
-    Also if the query is factual + time-sensitive, prefer search.
-    """
-    time_sensitive_tokens = {"latest","now","today","yesterday","recent","breaking","2025","2024","new","released","announce","updates"}
-
-    def should_search(self, query:str, user_prefers_search:Optional[bool]=None) -> bool:
-        if user_prefers_search is not None:
-            return user_prefers_search
-        q_lower = query.lower()
-        if any(tok in q_lower for tok in self.time_sensitive_tokens):
-            return True
-        
-        if re.match(r"^(when|who|what|where|how|is|are|did|do)\b", q_lower):
-            
-            return True
-        return False
-
-planner = QueryPlanner()
-
-class GoogleCustomSearchConnector:
-    """
-    Minimal wrapper for Google Programmable Search (Custom Search JSON API).
-    Produces a list of {'title','link','snippet','cacheId','displayLink'}.
-    Requires GOOGLE_API_KEY and SEARCH_ENGINE_ID in policy vault.
-    """
-    SEARCH_URL = "https://www.googleapis.com/customsearch/v1"
-
-    def __init__(self, policy_proxy:PolicyProxy):
-        self.policy = policy_proxy
-
-    def search(self, q:str, num:int=5) -> List[Dict]:
-        if not self.policy.check_and_consume("google_search_per_minute", 1):
-            logger.error("Quota exceeded for Google search")
-            return []
-            
-        api_key = self.policy.get_secret("GOOGLE_API_KEY")
-        cx = self.policy.get_secret("SEARCH_ENGINE_ID")
-        
-        if not api_key or not cx:
-            logger.error(f"Missing Google API credentials - API Key: {bool(api_key)}, Search Engine ID: {bool(cx)}")
-            return []
-            
-        params = {"key": api_key, "cx": cx, "q": q, "num": min(num, 10)}
-        
-        try:
-            logger.info(f"Making Google search request for query: {q}")
-            r = requests.get(self.SEARCH_URL, params=params, timeout=10)
-            
-            if r.status_code != 200:
-                logger.error(f"Google search failed with status {r.status_code}: {r.text[:200]}")
-                return []
-                
-            data = r.json()
-            
-            if "error" in data:
-                logger.error(f"Google API error: {data['error']}")
-                return []
-                
-            items = []
-            for it in data.get("items", []):
-                items.append({
-                    "title": it.get("title", ""),
-                    "link": it.get("link", ""),
-                    "snippet": it.get("snippet", ""),
-                    "displayLink": it.get("displayLink", ""),
-                    "cacheId": it.get("cacheId", "")
-                })
-                
-            logger.info(f"Successfully retrieved {len(items)} search results")
-            self.policy.log_request({"type": "google_search", "query": q, "count": len(items)})
-            return items
-            
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Network error during Google search: {e}")
-            return []
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse Google search response: {e}")
-            return []
-        except Exception as e:
-            logger.error(f"Unexpected error during Google search: {e}")
-            return []
-
-class SerpApiConnector:
-    """
-    Minimal SerpAPI connector fallback. Requires SERPAPI_KEY.
-    """
-    SERP_URL = "https://serpapi.com/search.json"
-    def __init__(self, policy_proxy:PolicyProxy):
-        self.policy = policy_proxy
-
-    def search(self, q:str, num:int=5) -> List[Dict]:
-        key = self.policy.get_secret("SERPAPI_KEY")
-        if not key:
-            logger.info("No SerpAPI key found, skipping SerpAPI search")
-            return []
-            
-        params = {"q": q, "engine": "google", "api_key": key, "num": num}
-        
-        try:
-            logger.info(f"Making SerpAPI search request for query: {q}")
-            r = requests.get(self.SERP_URL, params=params, timeout=10)
-            
-            if r.status_code != 200:
-                logger.error(f"SerpAPI search failed with status {r.status_code}")
-                return []
-                
-            js = r.json()
-            
-            if "error" in js:
-                logger.error(f"SerpAPI error: {js['error']}")
-                return []
-                
-            res = []
-            for p in js.get("organic_results", [])[:num]:
-                res.append({
-                    "title": p.get("title", ""),
-                    "link": p.get("link", ""),
-                    "snippet": p.get("snippet", "")
-                })
-                
-            logger.info(f"Successfully retrieved {len(res)} SerpAPI results")
-            self.policy.log_request({"type": "serpapi_search", "query": q, "count": len(res)})
-            return res
-            
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Network error during SerpAPI search: {e}")
-            return []
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse SerpAPI response: {e}")
-            return []
-        except Exception as e:
-            logger.error(f"Unexpected error during SerpAPI search: {e}")
-            return []
-
-
-class SimpleFetcher:
-    """
-    Fetches pages with respect for robots.txt and conditional requests using ETag/Last-Modified.
-    Keeps a local file-based cache mapping URL->(etag,lastmod,content,access_time)
-    """
-    def __init__(self, cache_path="fetch_cache.json", user_agent="rtsearch-bot/1.0"):
-        self.cache_path = cache_path
-        self.user_agent = user_agent
-        self._load_cache()
-        self.robots_cache = {}
-
-    def _load_cache(self):
-        try:
-            with open(self.cache_path, "r", encoding="utf-8") as f:
-                self.cache = json.load(f)
-        except Exception:
-            self.cache = {}
-
-    def _save_cache(self):
-        with open(self.cache_path, "w", encoding="utf-8") as f:
-            json.dump(self.cache, f)
-
-    def _can_fetch(self, url):
-        parsed = urlparse(url)
-        base = f"{parsed.scheme}://{parsed.netloc}"
-        
-        
-        trusted_domains = [
-            "wikipedia.org", "britannica.com", "gov.in", "edu", 
-            "stackoverflow.com", "github.com", "medium.com"
-        ]
-        
-        if any(domain in parsed.netloc for domain in trusted_domains):
-            return True
-            
-        rp = self.robots_cache.get(base)
-        if rp is None:
-            try:
-                robots_url = urljoin(base, "/robots.txt")
-                r = requests.get(robots_url, headers={"User-Agent": self.user_agent}, timeout=3)
-                rp = r.text if r.status_code == 200 else ""
-            except Exception:
-                rp = ""
-            self.robots_cache[base] = rp
-        
-        txt = self.robots_cache.get(base, "")
-        
-        if re.search(r"User-agent:\s*\*\s*Disallow:\s*/\s*$", txt, re.I | re.M):
-            return False
-        return True
-
-    def fetch(self, url, force=False, timeout=10) -> Dict:
-        if not self._can_fetch(url):
-            logger.warning("robots.txt blocks fetching %s", url)
-            return {"url":url,"status":"blocked","content":""}
-        headers = {"User-Agent": self.user_agent}
-        cached = self.cache.get(url)
-        if cached and not force:
-            
-            if cached.get("etag"):
-                headers["If-None-Match"] = cached["etag"]
-            if cached.get("last_modified"):
-                headers["If-Modified-Since"] = cached["last_modified"]
-        try:
-            r = requests.get(url, headers=headers, timeout=timeout)
-        except Exception as e:
-            logger.warning("Fetch error %s for %s", e, url)
-            return {"url":url,"status":"error","content":""}
-        if r.status_code == HTTPStatus.NOT_MODIFIED and cached:
-            cached["accessed"] = time.time()
-            self.cache[url] = cached
-            self._save_cache()
-            return {"url":url,"status":"not_modified","content":cached.get("content",""), "headers":r.headers}
-        content = r.text
-        
-        entry = {
-            "etag": r.headers.get("ETag"),
-            "last_modified": r.headers.get("Last-Modified"),
-            "content": content,
-            "accessed": time.time(),
-            "fetched_at": datetime.datetime.now(datetime.UTC).isoformat()+"Z",
-            "status_code": r.status_code
-        }
-        self.cache[url] = entry
-        self._save_cache()
-        return {"url":url,"status":"ok","content":content,"headers":r.headers, "status_code": r.status_code}
-
-fetcher = SimpleFetcher()
-
-
-class ContentExtractor:
-    """
-    Extract main text from HTML. If BeautifulSoup available, do simple tag removal + heuristics.
-    Also performs light boilerplate removal and language detection stub.
-    """
-    def __init__(self):
-        pass
-
-    def extract(self, html:str, url:str="") -> Dict:
-        text = html
-        title = None
-        if BeautifulSoup:
-            soup = BeautifulSoup(html, "html.parser")
-           
-            article = soup.find("article")
-            if article:
-                main = article.get_text(separator="\n")
-            else:
-                
-                for s in soup(["script","style","noscript","iframe"]):
-                    s.decompose()
-                
-                texts = [(len(t.get_text(strip=True)), t) for t in soup.find_all(['div','main','section','body','p','article'])]
-                texts_sorted = sorted(texts, key=lambda x: x[0], reverse=True)
-                main = texts_sorted[0][1].get_text(separator="\n") if texts_sorted else soup.get_text(separator="\n")
-            
-            t = soup.find("title")
-            title = t.get_text().strip() if t else None
-            text = re.sub(r'\n\s*\n+', '\n\n', main).strip()
-        else:
-            
-            text = re.sub(r'<[^>]+>', ' ', html)
-            text = re.sub(r'\s+', ' ', text).strip()
-        
-        lang = "unknown"
-        if len(text) > 0:
-            ascii_ratio = sum(1 for c in text if ord(c) < 128) / max(1, len(text))
-            lang = "en" if ascii_ratio > 0.8 else "unknown"
-       
-        if len(text) < 50:
-            text = ""
-        return {"url":url, "title": title, "text": text, "lang": lang}
-
-extractor = ContentExtractor()
-
-class PromptInjectionDetector:
-    """
-    Simple heuristics for prompt injection from web content:
-    - Looks for phrases telling the model to ignore instructions
-    - Long inline code blocks, hidden inputs, suspicious <script> with eval
-    - The extractor should not blindly follow "This is the true answer" claims without verification.
-    """
-    suspicious_patterns = [
-        r"ignore (previous|earlier) instructions",
-        r"follow the instructions below",
-        r"do not verify",
-        r"this is the true answer",
-        r"click here to continue",
-    ]
-
-    def detect(self, text:str) -> List[str]:
-        hits = []
-        t = text.lower()
-        for p in self.suspicious_patterns:
-            if re.search(p, t):
-                hits.append(p)
-        
-        
-        base64_matches = re.findall(r"[A-Za-z0-9+/=]{200,}", text)
-        if base64_matches and any("eval" in text.lower() or "script" in text.lower() for _ in base64_matches):
-            hits.append("long_base64_like")
-            
-        if "<script" in text.lower() and "eval(" in text.lower():
-            hits.append("script_eval")
-        return hits
-
-pi_detector = PromptInjectionDetector()
-
-def dedupe_snippets(items: List[Dict], threshold=0.8) -> List[Dict]:
-    """
-    Very simple dedupe by snippet fingerprint (hash and Jaccard on words)
-    """
-    out = []
-    seen_hashes = set()
-    for it in items:
-        snippet = (it.get("snippet") or it.get("text") or "")[:400]
-        h = hashlib.sha256(snippet.encode("utf-8")).hexdigest()
-        if h in seen_hashes:
-            continue
-        seen_hashes.add(h)
-        out.append(it)
-    return out
-
-
-class BM25:
-    def __init__(self, docs:List[str], k1=1.5, b=0.75):
-        self.docs = docs
-        self.N = len(docs)
-        self.avgdl = sum(len(d.split()) for d in docs) / max(1, self.N)
-        self.k1 = k1
-        self.b = b
-        self.doc_freqs = []
-        self.df = {}
-        self.term_freqs = []
-        for doc in docs:
-            freqs = Counter(doc.split())
-            self.term_freqs.append(freqs)
-            for t in freqs.keys():
-                self.df[t] = self.df.get(t,0) + 1
-
-    def score(self, query:str) -> List[float]:
-        q_terms = query.split()
-        scores = [0.0]*self.N
-        for qi in q_terms:
-            df = self.df.get(qi,0)
-            idf = max(0.0, (self.N - df + 0.5) / (df + 0.5))
-            idf = max(0.001, (self.N - df + 0.5) / (df + 0.5))  
-            idf = max(0.0, math_log(idf))
-            for i, freqs in enumerate(self.term_freqs):
-                f = freqs.get(qi,0)
-                denom = f + self.k1 * (1 - self.b + self.b * len(self.docs[i].split()) / self.avgdl)
-                scores[i] += idf * (f * (self.k1+1) / (denom + 1e-8))
-        return scores
-
-import math
-def math_log(x):
-    return math.log(x+1e-12)
-
-
-class Reranker:
-    def __init__(self, docs:List[str]):
-        self.docs = docs
-        try:
-            self.bm25 = BM25(docs)
-        except Exception as e:
-            self.bm25 = None
-        if sklearn_available:
-            self.vectorizer = TfidfVectorizer(stop_words="english")
-            self.tfidf = self.vectorizer.fit_transform(docs)
-        else:
-            self.vectorizer = None
-            self.tfidf = None
-
-    def rank(self, query:str, top_k:int=5) -> List[Tuple[int,float]]:
-        
-        scores = []
-        if self.bm25:
-            bm_scores = self.bm25.score(query)
-        else:
-            bm_scores = [0]*len(self.docs)
-        
-        if self.tfidf is not None:
-            qv = self.vectorizer.transform([query])
-            cos = cosine_similarity(self.tfidf, qv).reshape(-1)
-            cos_scores = cos.tolist()
-        else:
-            cos_scores = [0.0]*len(self.docs)
-       
-        for i in range(len(self.docs)):
-            combined = 0.6*bm_scores[i] + 0.4*cos_scores[i]
-            scores.append((i, combined))
-        scores_sorted = sorted(scores, key=lambda x: x[1], reverse=True)
-        return scores_sorted[:top_k]
-
-
-def chunk_text(text:str, chunk_size:int=500, overlap:int=50) -> List[str]:
-    words = text.split()
-    out = []
-    i=0
-    while i < len(words):
-        chunk = words[i:i+chunk_size]
-        out.append(" ".join(chunk))
-        if i+chunk_size >= len(words):
-            break
-        i += chunk_size - overlap
-    return out
-
-def generate_citation(result:Dict, access_time:Optional[datetime.datetime]=None, quote:Optional[str]=None) -> Dict:
-    access_time = access_time or datetime.datetime.now(datetime.UTC)
-    c = {
-        "url": result.get("link") or result.get("url"),
-        "title": result.get("title") or result.get("displayLink") or "",
-        "accessed": access_time.isoformat()+"Z"
-    }
-    if quote:
-        c["quote"] = quote
-    return c
-
-def compose_answer(query:str, ranked_items:List[Dict], used_spans:List[Tuple[str,str]]):
-    """
-    Compose an answer: synthesize main claim from top sources (very simple),
-    add citations and confidence estimate (heuristic).
-    used_spans: list of (url, span_text) that were pulled to support each claim
-    """
-    
-    top_snips = [it.get("snippet") or (it.get("text")[:900] if it.get("text") else "") for it in ranked_items[:3]]
-    body = "\n\n".join(s for s in top_snips if s)
-    citations = [generate_citation(it, quote=(used_spans[idx][1] if idx < len(used_spans) else None))
-                 for idx, it in enumerate(ranked_items[:len(used_spans)])]
-    
-    confidence = min(0.95, 0.4 + 0.2*len(ranked_items) + 0.1*(1 if "trusted" in (ranked_items[0].get("displayLink","") if ranked_items else "") else 0))
-    return {"answer": body or "I found sources but couldn't synthesize a short answer.", "citations": citations, "confidence": round(confidence,2)}
-
-class Orchestrator:
-    def __init__(self, policy:PolicyProxy):
-        self.policy = policy
-        self.google = GoogleCustomSearchConnector(policy)
-        self.serp = SerpApiConnector(policy)
-        self.fetcher = fetcher
-        self.extractor = extractor
-
-    def handle_query(self, query:str, user_prefers_search:Optional[bool]=None) -> Dict:
-        do_search = planner.should_search(query, user_prefers_search)
-        if not do_search:
-            logger.info("Planner decided not to search; returning model knowledge (simulated)")
-            return {"answer": f"(model-only) I think: {query}", "citations": [], "confidence": 0.4}
-       
-        results = self.google.search(query, num=6)
-        if not results:
-            results = self.serp.search(query, num=6)
-        results = dedupe_snippets(results)
-        fetched = []
-        for r in results[:6]:
-            url = r.get("link") or r.get("url")
-            if not url:
-                continue
-            page = self.fetcher.fetch(url)
-            if page.get("status") in ("blocked","error"):
-                continue
-            content = page.get("content","")
-            extracted = self.extractor.extract(content, url=url)
-            
-            injections = pi_detector.detect(content)
-            if injections and len(injections) > 1: 
-                logger.warning("Multiple prompt injection patterns detected in %s: %s", url, injections)
-                continue
-            elif injections:
-                logger.info("Minor injection pattern detected in %s: %s (proceeding anyway)", url, injections)
-            r2 = r.copy()
-            r2.update({"text": extracted.get("text",""), "title_extracted": extracted.get("title")})
-            fetched.append(r2)
-        if not fetched:
-            return {"answer":"No fetchable sources found.","citations":[],"confidence":0.2}
-        docs = [f.get("text") or f.get("snippet","") for f in fetched]
-        reranker = Reranker(docs)
-        ranked_idx = reranker.rank(query, top_k=min(5,len(docs)))
-        ranked_items = [fetched[i] for i,score in ranked_idx]
-        used_spans=[]
-        for it in ranked_items:
-            txt = it.get("text","")
-            chunks = chunk_text(txt, chunk_size=250, overlap=40)
-            
-            found_span=None
-            q_terms = [t for t in re.findall(r"\w+", query.lower()) if len(t)>2]
-            for ch in chunks:
-                ch_low = ch.lower()
-                if all(any(qt in token for token in ch_low.split()) for qt in q_terms[:3]):  
-                    found_span = ch[:500]
-                    break
-            if not found_span and chunks:
-                found_span = chunks[0][:500]
-            used_spans.append((it.get("link") or it.get("url"), found_span))
-        answer_obj = compose_answer(query, ranked_items, used_spans)
-        answer_obj["model"] = "simulated (compose)"
-        answer_obj["generated_at"] = datetime.datetime.now(datetime.UTC).isoformat()+"Z"
-        return answer_obj
-
-orch = Orchestrator(policy)
-
-def example():
-    q = "Where is TamilNadu located?"
-    print("Query:", q)
-    res = orch.handle_query(q)
-    print("\n--- SYNTHESIZED ANSWER ---")
-    print(res["answer"])
-    print("\n--- CITATIONS ---")
-    print(json.dumps(res["citations"], indent=2))
-    print("\nConfidence:", res["confidence"])
-
-if __name__ == "__main__":
+import os
+import math
+import time
+import json
+import hashlib
+import logging
+import requests
+import sqlite3
+import threading
+import itertools
+import asyncio
+import datetime
+from urllib.parse import urlparse, urljoin
+from urllib import robotparser
+from http import HTTPStatus
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from collections import defaultdict, Counter
+from typing import List, Dict, Tuple, Optional
+import re
+import string
+from dotenv import load_dotenv
+
+load_dotenv()
+
+try:
+    from bs4 import BeautifulSoup
+except Exception:
+    BeautifulSoup = None
+
+# lxml parses at C speed (10-30x faster than html.parser on big pages);
+# BeautifulSoup stays as the fallback
+try:
+    import lxml.html
+    from lxml.etree import strip_elements
+    lxml_available = True
+except Exception:
+    lxml_available = False
+
+try:
+    import nltk
+    nltk_available = True
+except Exception:
+    nltk_available = False
+
+try:
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.metrics.pairwise import linear_kernel
+    sklearn_available = True
+except Exception:
+    sklearn_available = False
+
+try:
+    import numpy as np
+    numpy_available = True
+except Exception:
+    numpy_available = False
+
+# orjson parses/serializes several times faster than stdlib json; these
+# helpers fall back cleanly when it isn't installed
+try:
+    import orjson
+
+    def _json_loads(data):
+        return orjson.loads(data)
+
+    def _json_dumps_str(obj) -> str:
+        return orjson.dumps(obj).decode()
+except Exception:
+    def _json_loads(data):
+        return json.loads(data)
+
+    def _json_dumps_str(obj) -> str:
+        return json.dumps(obj)
+
+# xxHash3 runs ~40x faster than SHA-256 and dedupe fingerprints don't
+# need cryptographic strength; fall back to truncated SHA-256
+try:
+    import xxhash
+
+    def _fingerprint(data:bytes) -> int:
+        return xxhash.xxh3_64_intdigest(data)
+except Exception:
+    def _fingerprint(data:bytes) -> int:
+        return int.from_bytes(hashlib.sha256(data).digest()[:8], "big")
+
+logger = logging.getLogger("rtsearch")
+logger.setLevel(logging.DEBUG)
+ch = logging.StreamHandler()
+ch.setFormatter(logging.Formatter("%(asctime)s %(levelname)s: %(message)s"))
+logger.addHandler(ch)
+
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+def _make_session() -> requests.Session:
+    """Session with connection pooling so repeat requests to the same host
+    reuse the TCP+TLS connection instead of re-handshaking."""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=64,
+        max_retries=Retry(total=2, backoff_factor=0.2)
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+# Shared across the fetcher and both search connectors
+http_session = _make_session()
+
+# How long a host's robots.txt rules stay valid
+_ROBOTS_TTL = 86400
+
+# Hard cap on fetched body size; anything past this is cut off rather
+# than materialized (extraction never needs a 50 MB page)
+_MAX_FETCH_BYTES = 2_000_000
+
+
+class PolicyProxy:
+    """
+    Simple policy proxy that enforces basic quotas, secrets, and logs.
+    In production this would be a networked service that validates outgoing requests.
+    """
+    def __init__(self, quotas: Dict[str,int] = None):
+        self.quotas = quotas or {"google_search_per_minute": 60}
+        # Per-key (itertools.count, window_reset_ts); see check_and_consume
+        self.counters = {}
+        
+        
+        self.vault = {
+            "GOOGLE_API_KEY": os.environ.get("REACT_APP_GOOGLE_API_KEY") or os.environ.get("GOOGLE_API_KEY", ""),
+            "SEARCH_ENGINE_ID": os.environ.get("REACT_APP_SEARCH_ENGINE_ID") or os.environ.get("SEARCH_ENGINE_ID", ""),
+            "SERPAPI_KEY": os.environ.get("SERPAPI_KEY", "")
+        }
+        
+        print(f"Loaded API Key: {'***' + self.vault['GOOGLE_API_KEY'][-4:] if self.vault['GOOGLE_API_KEY'] else 'MISSING'}")
+        print(f"Loaded Search Engine ID: {self.vault['SEARCH_ENGINE_ID'] if self.vault['SEARCH_ENGINE_ID'] else 'MISSING'}")
+
+    def check_and_consume(self, key_name:str, cost:int=1) -> bool:
+        # Lock-free: next() on an itertools.count is a single C call and
+        # therefore atomic under the GIL, and rolling the window over is
+        # one atomic dict store of a fresh (counter, reset) pair. Threads
+        # racing the rollover can each install a new window, which at
+        # worst forgets a request at the boundary — acceptable for a soft
+        # per-minute quota, and no handler ever blocks on a shared lock.
+        now = time.time()
+        entry = self.counters.get(key_name)
+        if entry is None or now > entry[1]:
+            entry = (itertools.count(), now + 60)
+            self.counters[key_name] = entry
+        counter = entry[0]
+        used = next(counter)
+        for _ in range(cost - 1):
+            next(counter)
+        if used + cost > self.quotas.get(key_name, 1000000):
+            logger.warning(f"Quota exceeded for {key_name}")
+            return False
+        return True
+
+    def get_secret(self, name:str) -> str:
+        return self.vault.get(name,"")
+
+    def log_request(self, metadata:Dict):
+        logger.info(f"PolicyProxy log: {_json_dumps_str(metadata)}")
+
+policy = PolicyProxy()
+
+
+class QueryPlanner:
+    """
+    Very simple planner: if query contains 'recent' or date words or 'latest', prefer search.
+    Also if the query is factual + time-sensitive, prefer search.
+    """
+    time_sensitive_tokens = {"latest","now","today","yesterday","recent","breaking","2025","2024","new","released","announce","updates"}
+    _prefix_re = re.compile(r"^(when|who|what|where|how|is|are|did|do)\b")
+
+    def should_search(self, query:str, user_prefers_search:Optional[bool]=None) -> bool:
+        if user_prefers_search is not None:
+            return user_prefers_search
+        q_lower = query.lower()
+        if any(tok in q_lower for tok in self.time_sensitive_tokens):
+            return True
+
+        if self._prefix_re.match(q_lower):
+
+            return True
+        return False
+
+planner = QueryPlanner()
+
+class GoogleCustomSearchConnector:
+    """
+    Minimal wrapper for Google Programmable Search (Custom Search JSON API).
+    Produces a list of {'title','link','snippet','cacheId','displayLink'}.
+    Requires GOOGLE_API_KEY and SEARCH_ENGINE_ID in policy vault.
+    """
+    SEARCH_URL = "https://www.googleapis.com/customsearch/v1"
+
+    def __init__(self, policy_proxy:PolicyProxy):
+        self.policy = policy_proxy
+
+    def search(self, q:str, num:int=5) -> List[Dict]:
+        if not self.policy.check_and_consume("google_search_per_minute", 1):
+            logger.error("Quota exceeded for Google search")
+            return []
+            
+        api_key = self.policy.get_secret("GOOGLE_API_KEY")
+        cx = self.policy.get_secret("SEARCH_ENGINE_ID")
+        
+        if not api_key or not cx:
+            logger.error(f"Missing Google API credentials - API Key: {bool(api_key)}, Search Engine ID: {bool(cx)}")
+            return []
+            
+        params = {"key": api_key, "cx": cx, "q": q, "num": min(num, 10)}
+        
+        try:
+            logger.info(f"Making Google search request for query: {q}")
+            r = http_session.get(self.SEARCH_URL, params=params, timeout=10)
+            
+            if r.status_code != 200:
+                logger.error(f"Google search failed with status {r.status_code}: {r.text[:200]}")
+                return []
+                
+            # .content skips the UTF-8 decode step r.json()/r.text pays
+            data = _json_loads(r.content)
+            
+            if "error" in data:
+                logger.error(f"Google API error: {data['error']}")
+                return []
+                
+            items = []
+            for it in data.get("items", []):
+                items.append({
+                    "title": it.get("title", ""),
+                    "link": it.get("link", ""),
+                    "snippet": it.get("snippet", ""),
+                    "displayLink": it.get("displayLink", ""),
+                    "cacheId": it.get("cacheId", "")
+                })
+                
+            logger.info(f"Successfully retrieved {len(items)} search results")
+            self.policy.log_request({"type": "google_search", "query": q, "count": len(items)})
+            return items
+            
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Network error during Google search: {e}")
+            return []
+        except ValueError as e:
+            logger.error(f"Failed to parse Google search response: {e}")
+            return []
+        except Exception as e:
+            logger.error(f"Unexpected error during Google search: {e}")
+            return []
+
+class SerpApiConnector:
+    """
+    Minimal SerpAPI connector fallback. Requires SERPAPI_KEY.
+    """
+    SERP_URL = "https://serpapi.com/search.json"
+    def __init__(self, policy_proxy:PolicyProxy):
+        self.policy = policy_proxy
+
+    def search(self, q:str, num:int=5) -> List[Dict]:
+        key = self.policy.get_secret("SERPAPI_KEY")
+        if not key:
+            logger.info("No SerpAPI key found, skipping SerpAPI search")
+            return []
+            
+        params = {"q": q, "engine": "google", "api_key": key, "num": num}
+        
+        try:
+            logger.info(f"Making SerpAPI search request for query: {q}")
+            r = http_session.get(self.SERP_URL, params=params, timeout=10)
+            
+            if r.status_code != 200:
+                logger.error(f"SerpAPI search failed with status {r.status_code}")
+                return []
+                
+            js = _json_loads(r.content)
+            
+            if "error" in js:
+                logger.error(f"SerpAPI error: {js['error']}")
+                return []
+                
+            res = []
+            for p in js.get("organic_results", [])[:num]:
+                res.append({
+                    "title": p.get("title", ""),
+                    "link": p.get("link", ""),
+                    "snippet": p.get("snippet", "")
+                })
+                
+            logger.info(f"Successfully retrieved {len(res)} SerpAPI results")
+            self.policy.log_request({"type": "serpapi_search", "query": q, "count": len(res)})
+            return res
+            
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Network error during SerpAPI search: {e}")
+            return []
+        except ValueError as e:
+            logger.error(f"Failed to parse SerpAPI response: {e}")
+            return []
+        except Exception as e:
+            logger.error(f"Unexpected error during SerpAPI search: {e}")
+            return []
+
+
+class SimpleFetcher:
+    """
+    Fetches pages with respect for robots.txt and conditional requests using ETag/Last-Modified.
+    Keeps a local sqlite cache mapping URL->(etag,lastmod,content,access_time);
+    writes cost O(entry) instead of rewriting the whole cache per fetch.
+    """
+    def __init__(self, cache_path="fetch_cache.db", user_agent="rtsearch-bot/1.0",
+                 fresh_ttl=300, stale_ttl=86400):
+        self.cache_path = cache_path
+        self.user_agent = user_agent
+        # Entries younger than fresh_ttl are served without any network
+        # traffic; entries younger than stale_ttl are served immediately
+        # while a background revalidation refreshes them
+        self.fresh_ttl = fresh_ttl
+        self.stale_ttl = stale_ttl
+        self._revalidate_pool = ThreadPoolExecutor(max_workers=4)
+        self.robots_cache = {}
+        self._cache_lock = threading.Lock()
+        self._db = sqlite3.connect(cache_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, "
+            "content TEXT, accessed REAL, fetched_at TEXT, status_code INTEGER)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS robots (base TEXT PRIMARY KEY, body TEXT, fetched REAL)"
+        )
+        self._db.commit()
+
+    def _cache_get(self, url) -> Optional[Dict]:
+        with self._cache_lock:
+            row = self._db.execute(
+                "SELECT etag, last_modified, content, accessed, fetched_at, status_code "
+                "FROM pages WHERE url=?", (url,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "etag": row[0],
+            "last_modified": row[1],
+            "content": row[2],
+            "accessed": row[3],
+            "fetched_at": row[4],
+            "status_code": row[5],
+        }
+
+    def _cache_put(self, url, entry: Dict):
+        with self._cache_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?,?,?,?,?,?,?)",
+                (url, entry.get("etag"), entry.get("last_modified"),
+                 entry.get("content", ""), entry.get("accessed"),
+                 entry.get("fetched_at"), entry.get("status_code"))
+            )
+            self._db.commit()
+
+    def _can_fetch(self, url):
+        parsed = urlparse(url)
+        base = f"{parsed.scheme}://{parsed.netloc}"
+        
+        
+        trusted_domains = [
+            "wikipedia.org", "britannica.com", "gov.in", "edu", 
+            "stackoverflow.com", "github.com", "medium.com"
+        ]
+        
+        if any(domain in parsed.netloc for domain in trusted_domains):
+            return True
+            
+        rp = self._get_robot_parser(base)
+        return rp.can_fetch(self.user_agent, url)
+
+    def _get_robot_parser(self, base) -> robotparser.RobotFileParser:
+        now = time.time()
+        cached = self.robots_cache.get(base)
+        if cached and cached[1] > now:
+            return cached[0]
+
+        # Try the persisted copy before going to the network
+        body = None
+        with self._cache_lock:
+            row = self._db.execute(
+                "SELECT body, fetched FROM robots WHERE base=?", (base,)
+            ).fetchone()
+        if row and now - row[1] < _ROBOTS_TTL:
+            body = row[0]
+
+        if body is None:
+            try:
+                robots_url = urljoin(base, "/robots.txt")
+                r = http_session.get(robots_url, headers={"User-Agent": self.user_agent}, timeout=3)
+                body = r.text if r.status_code == 200 else ""
+            except Exception:
+                body = ""
+            with self._cache_lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO robots VALUES (?,?,?)", (base, body, now)
+                )
+                self._db.commit()
+
+        rp = robotparser.RobotFileParser()
+        rp.parse(body.splitlines())
+        self.robots_cache[base] = (rp, now + _ROBOTS_TTL)
+        return rp
+
+    def fetch(self, url, force=False, timeout=10) -> Dict:
+        if not self._can_fetch(url):
+            logger.warning("robots.txt blocks fetching %s", url)
+            return {"url":url,"status":"blocked","content":""}
+        cached = self._cache_get(url)
+        if cached and not force:
+            age = time.time() - (cached.get("accessed") or 0)
+            if age < self.fresh_ttl:
+                return {"url":url,"status":"fresh","content":cached.get("content","")}
+            if age < self.stale_ttl:
+                # Stale-while-revalidate: answer from cache now, refresh
+                # off the critical path
+                self._revalidate_pool.submit(self._fetch_network, url, cached, timeout)
+                return {"url":url,"status":"stale","content":cached.get("content","")}
+        return self._fetch_network(url, cached if not force else None, timeout)
+
+    def _fetch_network(self, url, cached, timeout) -> Dict:
+        headers = {"User-Agent": self.user_agent}
+        if cached:
+
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
+        try:
+            r = http_session.get(url, headers=headers, timeout=timeout, stream=True)
+        except Exception as e:
+            logger.warning("Fetch error %s for %s", e, url)
+            return {"url":url,"status":"error","content":""}
+        if r.status_code == HTTPStatus.NOT_MODIFIED and cached:
+            r.close()
+            cached["accessed"] = time.time()
+            self._cache_put(url, cached)
+            return {"url":url,"status":"not_modified","content":cached.get("content",""), "headers":r.headers}
+
+        # Skip non-HTML bodies (PDFs, images, ...) before downloading them
+        ctype = r.headers.get("Content-Type", "")
+        if ctype and not ctype.startswith(("text/html", "application/xhtml", "text/plain")):
+            logger.info("Skipping non-HTML content type %s for %s", ctype, url)
+            r.close()
+            return {"url":url,"status":"skipped","content":""}
+
+        # Stream with a size cap instead of materializing arbitrary bodies
+        buf = bytearray()
+        try:
+            for piece in r.iter_content(65536):
+                buf += piece
+                if len(buf) > _MAX_FETCH_BYTES:
+                    logger.info("Truncating oversized response from %s", url)
+                    break
+        except Exception as e:
+            logger.warning("Stream error %s for %s", e, url)
+            return {"url":url,"status":"error","content":""}
+        finally:
+            r.close()
+        content = bytes(buf).decode(r.encoding or "utf-8", errors="replace")
+
+        entry = {
+            "etag": r.headers.get("ETag"),
+            "last_modified": r.headers.get("Last-Modified"),
+            "content": content,
+            "accessed": time.time(),
+            "fetched_at": datetime.datetime.now(datetime.UTC).isoformat()+"Z",
+            "status_code": r.status_code
+        }
+        self._cache_put(url, entry)
+        return {"url":url,"status":"ok","content":content,"headers":r.headers, "status_code": r.status_code}
+
+fetcher = SimpleFetcher()
+
+
+class ContentExtractor:
+    """
+    Extract main text from HTML. If BeautifulSoup available, do simple tag removal + heuristics.
+    Also performs light boilerplate removal and language detection stub.
+    """
+    def __init__(self):
+        pass
+
+    def extract(self, html:str, url:str="") -> Dict:
+        text = html
+        title = None
+        if lxml_available:
+            try:
+                tree = lxml.html.fromstring(html)
+                strip_elements(tree, "script", "style", "noscript", "iframe", with_tail=False)
+
+                article = tree.find(".//article")
+                if article is not None:
+                    node = article
+                else:
+                    candidates = tree.xpath("//div|//main|//section|//body|//p|//article")
+                    node = max(candidates, key=lambda n: len(n.text_content()), default=tree)
+                main = "\n".join(t for t in node.itertext())
+
+                title_el = tree.find(".//title")
+                title = title_el.text_content().strip() if title_el is not None else None
+                text = re.sub(r'\n\s*\n+', '\n\n', main).strip()
+            except Exception as e:
+                logger.warning("lxml extraction failed for %s: %s", url, e)
+                text = re.sub(r'<[^>]+>', ' ', html)
+                text = re.sub(r'\s+', ' ', text).strip()
+        elif BeautifulSoup:
+            soup = BeautifulSoup(html, "html.parser")
+           
+            article = soup.find("article")
+            if article:
+                main = article.get_text(separator="\n")
+            else:
+                
+                for s in soup(["script","style","noscript","iframe"]):
+                    s.decompose()
+                
+                texts = [(len(t.get_text(strip=True)), t) for t in soup.find_all(['div','main','section','body','p','article'])]
+                texts_sorted = sorted(texts, key=lambda x: x[0], reverse=True)
+                main = texts_sorted[0][1].get_text(separator="\n") if texts_sorted else soup.get_text(separator="\n")
+            
+            t = soup.find("title")
+            title = t.get_text().strip() if t else None
+            text = re.sub(r'\n\s*\n+', '\n\n', main).strip()
+        else:
+            
+            text = re.sub(r'<[^>]+>', ' ', html)
+            text = re.sub(r'\s+', ' ', text).strip()
+        
+        lang = "unknown"
+        if len(text) > 0:
+            ascii_ratio = sum(1 for c in text if ord(c) < 128) / max(1, len(text))
+            lang = "en" if ascii_ratio > 0.8 else "unknown"
+       
+        if len(text) < 50:
+            text = ""
+        # Tokenize once here; BM25, chunking, and span search all reuse
+        # this list instead of re-splitting the same text downstream
+        return {"url":url, "title": title, "text": text, "lang": lang,
+                "tokens": _tokenize(text) if text else []}
+
+extractor = ContentExtractor()
+
+class PromptInjectionDetector:
+    """
+    Simple heuristics for prompt injection from web content:
+    - Looks for phrases telling the model to ignore instructions
+    - Long inline code blocks, hidden inputs, suspicious <script> with eval
+    - The extractor should not blindly follow "This is the true answer" claims without verification.
+    """
+    suspicious_patterns = [
+        r"ignore (previous|earlier) instructions",
+        r"follow the instructions below",
+        r"do not verify",
+        r"this is the true answer",
+        r"click here to continue",
+    ]
+    # One fused alternation so the regex engine scans the page once for
+    # all patterns; group names map matches back to the source pattern
+    _injection_re = re.compile(
+        "|".join(f"(?P<g{i}>{p})" for i, p in enumerate(suspicious_patterns)),
+        re.IGNORECASE
+    )
+    _base64_re = re.compile(r"[A-Za-z0-9+/=]{200,}")
+
+    def detect(self, text:str) -> List[str]:
+        t = text.lower()
+        hit_indices = set()
+        for m in self._injection_re.finditer(t):
+            hit_indices.add(int(m.lastgroup[1:]))
+        hits = [self.suspicious_patterns[i] for i in sorted(hit_indices)]
+
+
+        base64_matches = self._base64_re.findall(text)
+        if base64_matches and any("eval" in text.lower() or "script" in text.lower() for _ in base64_matches):
+            hits.append("long_base64_like")
+            
+        if "<script" in text.lower() and "eval(" in text.lower():
+            hits.append("script_eval")
+        return hits
+
+pi_detector = PromptInjectionDetector()
+
+def _simhash64(tokens: List[str]) -> int:
+    """64-bit SimHash over tokens; near-duplicate texts land within a few
+    bits of each other"""
+    weights = [0]*64
+    for tok, cnt in Counter(tokens).items():
+        # builtin hash() is salted per process; _fingerprint keeps the
+        # signatures stable across runs and workers
+        h = _fingerprint(tok.encode("utf-8"))
+        for bit in range(64):
+            if (h >> bit) & 1:
+                weights[bit] += cnt
+            else:
+                weights[bit] -= cnt
+    fingerprint = 0
+    for bit, w in enumerate(weights):
+        if w > 0:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def dedupe_snippets(items: List[Dict], max_hamming=3) -> List[Dict]:
+    """
+    Dedupe snippets: exact-match by hash first, then near-duplicate by
+    SimHash hamming distance (Google and SerpAPI overlap heavily with
+    small wording differences that exact hashing misses)
+    """
+    out = []
+    seen_hashes = set()
+    seen_simhashes = []
+    for it in items:
+        snippet = (it.get("snippet") or it.get("text") or "")[:400]
+        h = _fingerprint(snippet.encode("utf-8"))
+        if h in seen_hashes:
+            continue
+        tokens = _tokenize(snippet)
+        sh = _simhash64(tokens)
+        # Short texts flip more bits per changed word (a one-word edit in
+        # a ~25-token snippet lands around 7 bits out), so widen the gate
+        # as token count drops; unrelated texts sit near 32 bits apart
+        threshold = min(16, max(max_hamming, int(64 / max(len(tokens), 1) ** 0.5)))
+        if any(bin(sh ^ seen).count("1") <= threshold for seen in seen_simhashes):
+            continue
+        seen_hashes.add(h)
+        seen_simhashes.append(sh)
+        out.append(it)
+    return out
+
+
+# Canonical tokenization: strip punctuation and lowercase in two C-level
+# passes so document and query tokens actually match (plain .split() left
+# "word," and "Word" as distinct terms)
+_STRIP_TABLE = str.maketrans(string.punctuation, ' ' * len(string.punctuation))
+
+
+def _tokenize(text:str) -> List[str]:
+    return text.translate(_STRIP_TABLE).lower().split()
+
+
+# Token counts per document content, shared across BM25 builds; popular
+# URLs show up in result sets repeatedly and re-counting them per query
+# is the expensive part of index construction
+_TOKEN_COUNT_CACHE = {}
+_TOKEN_COUNT_CACHE_MAX = 512
+
+
+def _token_counts(doc:str, tokens:Optional[List[str]]=None) -> Counter:
+    key = hash(doc)
+    counts = _TOKEN_COUNT_CACHE.get(key)
+    if counts is None:
+        # Callers that already hold the token list (the extractor produces
+        # one per page) pass it in and skip the re-tokenization entirely
+        counts = Counter(tokens if tokens is not None else _tokenize(doc))
+        if len(_TOKEN_COUNT_CACHE) >= _TOKEN_COUNT_CACHE_MAX:
+            _TOKEN_COUNT_CACHE.pop(next(iter(_TOKEN_COUNT_CACHE)))
+        _TOKEN_COUNT_CACHE[key] = counts
+    return counts
+
+
+class BM25:
+    def __init__(self, docs:List[str], k1=1.5, b=0.75, token_lists:Optional[List[List[str]]]=None):
+        self.docs = docs
+        self.N = len(docs)
+        self.k1 = k1
+        self.b = b
+        if token_lists is None:
+            token_lists = [None] * len(docs)
+        self.term_freqs = [_token_counts(doc, toks) for doc, toks in zip(docs, token_lists)]
+        self.doc_lens = [sum(freqs.values()) for freqs in self.term_freqs]
+        self.avgdl = (sum(self.doc_lens) / max(1, self.N)) or 1.0
+        self.df = {}
+        for freqs in self.term_freqs:
+            for t in freqs.keys():
+                self.df[t] = self.df.get(t,0) + 1
+        if numpy_available:
+            # Postings lists (term -> doc indices + tfs) let scoring touch
+            # only documents that contain a query term, vectorized
+            postings = defaultdict(lambda: ([], []))
+            for i, freqs in enumerate(self.term_freqs):
+                for t, f in freqs.items():
+                    postings[t][0].append(i)
+                    postings[t][1].append(f)
+            self.postings = {
+                t: (np.asarray(ix, dtype=np.intp), np.asarray(tf, dtype=np.float64))
+                for t, (ix, tf) in postings.items()
+            }
+            self.doc_lens = np.asarray(self.doc_lens, dtype=np.float64)
+
+    def _idf(self, df:int) -> float:
+        return math.log(1 + (self.N - df + 0.5) / (df + 0.5))
+
+    def score(self, query:str) -> List[float]:
+        q_terms = _tokenize(query)
+        k1 = self.k1
+        k1_plus1 = k1 + 1
+        if numpy_available:
+            scores = np.zeros(self.N)
+            denom_base = 1 - self.b + self.b * self.doc_lens / self.avgdl
+            for qi in q_terms:
+                posting = self.postings.get(qi)
+                if posting is None:
+                    continue
+                ix, tf = posting
+                idf = self._idf(len(ix))
+                denom = tf + k1 * denom_base[ix]
+                scores[ix] += idf * (tf * k1_plus1 / (denom + 1e-8))
+            return scores.tolist()
+
+        # Pure-Python fallback
+        scores = [0.0]*self.N
+        denom_base = [1 - self.b + self.b * dl / self.avgdl for dl in self.doc_lens]
+        for qi in q_terms:
+            df = self.df.get(qi,0)
+            if df == 0:
+                continue
+            idf = self._idf(df)
+            for i, freqs in enumerate(self.term_freqs):
+                f = freqs.get(qi,0)
+                if not f:
+                    continue
+                denom = f + k1 * denom_base[i]
+                scores[i] += idf * (f * k1_plus1 / (denom + 1e-8))
+        return scores
+
+# Fitted TF-IDF (vectorizer, matrix) pairs keyed by document set; repeat
+# queries over the same fetched pages skip the vocabulary rebuild
+_TFIDF_CACHE = {}
+_TFIDF_CACHE_MAX = 64
+
+
+def _fit_tfidf(docs:List[str]):
+    key = hash(tuple(docs))
+    cached = _TFIDF_CACHE.get(key)
+    if cached is not None:
+        return cached
+    vectorizer = TfidfVectorizer(stop_words="english")
+    tfidf = vectorizer.fit_transform(docs)
+    if len(_TFIDF_CACHE) >= _TFIDF_CACHE_MAX:
+        _TFIDF_CACHE.pop(next(iter(_TFIDF_CACHE)))
+    _TFIDF_CACHE[key] = (vectorizer, tfidf)
+    return vectorizer, tfidf
+
+
+class Reranker:
+    def __init__(self, docs:List[str], token_lists:Optional[List[List[str]]]=None):
+        self.docs = docs
+        try:
+            self.bm25 = BM25(docs, token_lists=token_lists)
+        except Exception as e:
+            self.bm25 = None
+        if sklearn_available:
+            self.vectorizer, self.tfidf = _fit_tfidf(docs)
+        else:
+            self.vectorizer = None
+            self.tfidf = None
+
+    def rank(self, query:str, top_k:int=5) -> List[Tuple[int,float]]:
+        return self.rank_batch([query], [top_k])[0]
+
+    def rank_batch(self, queries:List[str], top_ks:List[int]) -> List[List[Tuple[int,float]]]:
+        """Rank several queries over the same document set at once. All
+        queries go through one vectorizer.transform and one linear_kernel
+        call — a single sparse matmul instead of one per query."""
+        n = len(self.docs)
+        if self.tfidf is not None:
+            qm = self.vectorizer.transform(queries)
+            # rows are already L2-normalized, so linear_kernel == cosine;
+            # result is n_docs x n_queries
+            cos = linear_kernel(self.tfidf, qm)
+        else:
+            cos = None
+
+        out = []
+        for j, (query, top_k) in enumerate(zip(queries, top_ks)):
+            if self.bm25:
+                bm_scores = self.bm25.score(query)
+            else:
+                bm_scores = [0]*n
+            cos_scores = cos[:, j].tolist() if cos is not None else [0.0]*n
+            scores = [(i, 0.6*bm_scores[i] + 0.4*cos_scores[i]) for i in range(n)]
+            scores.sort(key=lambda x: x[1], reverse=True)
+            out.append(scores[:top_k])
+        return out
+
+
+def chunk_text(text:str, chunk_size:int=500, overlap:int=50, words:Optional[List[str]]=None) -> List[str]:
+    # Accept a precomputed word list so callers that already tokenized
+    # (e.g. for BM25) don't split the same text twice
+    if words is None:
+        words = text.split()
+    out = []
+    i=0
+    while i < len(words):
+        chunk = words[i:i+chunk_size]
+        out.append(" ".join(chunk))
+        if i+chunk_size >= len(words):
+            break
+        i += chunk_size - overlap
+    return out
+
+def generate_citation(result:Dict, access_time:Optional[datetime.datetime]=None, quote:Optional[str]=None) -> Dict:
+    access_time = access_time or datetime.datetime.now(datetime.UTC)
+    c = {
+        "url": result.get("link") or result.get("url"),
+        "title": result.get("title") or result.get("displayLink") or "",
+        "accessed": access_time.isoformat()+"Z"
+    }
+    if quote:
+        c["quote"] = quote
+    return c
+
+def compose_answer(query:str, ranked_items:List[Dict], used_spans:List[Tuple[str,str]]):
+    """
+    Compose an answer: synthesize main claim from top sources (very simple),
+    add citations and confidence estimate (heuristic).
+    used_spans: list of (url, span_text) that were pulled to support each claim
+    """
+
+    # Single pass emitting both snippets and citations; also guards the
+    # text slice against None, which used to crash here
+    top_snips = []
+    citations = []
+    n_spans = len(used_spans)
+    for idx, it in enumerate(ranked_items):
+        if idx >= 3 and idx >= n_spans:
+            break
+        if idx < 3:
+            snip = it.get("snippet") or (it.get("text") or "")[:900]
+            if snip:
+                top_snips.append(snip)
+        if idx < n_spans:
+            citations.append(generate_citation(it, quote=used_spans[idx][1]))
+    body = "\n\n".join(top_snips)
+
+    confidence = min(0.95, 0.4 + 0.2*len(ranked_items) + 0.1*(1 if "trusted" in (ranked_items[0].get("displayLink","") if ranked_items else "") else 0))
+    return {"answer": body or "I found sources but couldn't synthesize a short answer.", "citations": citations, "confidence": round(confidence,2)}
+
+def _do_rerank(docs:List[str], doc_tokens:List[List[str]], query:str, top_k:int) -> List[Tuple[int,float]]:
+    """Build a Reranker and rank; module-level so it pickles cleanly into
+    the rerank worker processes (each worker keeps its own TF-IDF and
+    token-count caches)."""
+    return Reranker(docs, token_lists=doc_tokens).rank(query, top_k=top_k)
+
+
+# TF-IDF fit + BM25 construction are pure CPU; running them in worker
+# processes keeps the GIL free for the event loop serving other clients
+_RERANK_POOL = None
+_rerank_pool_lock = threading.Lock()
+
+
+def _get_rerank_pool() -> ProcessPoolExecutor:
+    global _RERANK_POOL
+    if _RERANK_POOL is None:
+        with _rerank_pool_lock:
+            if _RERANK_POOL is None:
+                _RERANK_POOL = ProcessPoolExecutor(
+                    max_workers=max(1, (os.cpu_count() or 2) - 1)
+                )
+    return _RERANK_POOL
+
+
+def _do_rerank_batch(docs:List[str], doc_tokens:List[List[str]], queries:List[str],
+                     top_ks:List[int]) -> List[List[Tuple[int,float]]]:
+    """Batch counterpart of _do_rerank; one Reranker build serves every
+    pending query over the same document set."""
+    return Reranker(docs, token_lists=doc_tokens).rank_batch(queries, top_ks)
+
+
+class _RerankBatcher:
+    """
+    Coalesce rerank requests that arrive within a short window. Queries
+    sharing a document set are stacked through one TF-IDF transform and
+    one linear_kernel call in the worker process, then the per-query
+    rankings are split back out to each caller's future.
+    """
+    WINDOW = 0.02
+
+    def __init__(self):
+        self._queue = None
+        self._worker_task = None
+
+    async def rank(self, docs:List[str], doc_tokens:List[List[str]], query:str,
+                   top_k:int) -> List[Tuple[int,float]]:
+        loop = asyncio.get_running_loop()
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._worker_task = loop.create_task(self._worker())
+        future = loop.create_future()
+        self._queue.put_nowait((docs, doc_tokens, query, top_k, future))
+        return await future
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            # Let near-simultaneous queries pile up before dispatching
+            await asyncio.sleep(self.WINDOW)
+            while not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            groups = defaultdict(list)
+            for entry in batch:
+                groups[hash(tuple(entry[0]))].append(entry)
+
+            for entries in groups.values():
+                docs, doc_tokens = entries[0][0], entries[0][1]
+                queries = [e[2] for e in entries]
+                top_ks = [e[3] for e in entries]
+                try:
+                    results = await loop.run_in_executor(
+                        _get_rerank_pool(), _do_rerank_batch,
+                        docs, doc_tokens, queries, top_ks
+                    )
+                    for entry, ranked in zip(entries, results):
+                        if not entry[4].done():
+                            entry[4].set_result(ranked)
+                except Exception as e:
+                    for entry in entries:
+                        if not entry[4].done():
+                            entry[4].set_exception(e)
+
+
+_rerank_batcher = _RerankBatcher()
+
+
+def _prepare_docs(fetched:List[Dict]) -> Tuple[List[str], List[List[str]]]:
+    """Pair each fetched item with its token list; snippets (used when
+    extraction came back empty) are the only texts tokenized here."""
+    docs = []
+    doc_tokens = []
+    for f in fetched:
+        if f.get("text"):
+            docs.append(f["text"])
+            doc_tokens.append(f["tokens"])
+        else:
+            snippet = f.get("snippet","")
+            docs.append(snippet)
+            doc_tokens.append(_tokenize(snippet))
+    return docs, doc_tokens
+
+
+class Orchestrator:
+    def __init__(self, policy:PolicyProxy):
+        self.policy = policy
+        self.google = GoogleCustomSearchConnector(policy)
+        self.serp = SerpApiConnector(policy)
+        self.fetcher = fetcher
+        self.extractor = extractor
+        # Fetches are I/O-bound; issue them concurrently so the fetch step
+        # costs one slow round trip instead of the sum of all of them
+        self.fetch_pool = ThreadPoolExecutor(max_workers=8)
+
+    def handle_query(self, query:str, user_prefers_search:Optional[bool]=None) -> Dict:
+        do_search = planner.should_search(query, user_prefers_search)
+        if not do_search:
+            logger.info("Planner decided not to search; returning model knowledge (simulated)")
+            return {"answer": f"(model-only) I think: {query}", "citations": [], "confidence": 0.4}
+
+        fetched = self._search_and_fetch(query)
+        if not fetched:
+            return {"answer":"No fetchable sources found.","citations":[],"confidence":0.2}
+        docs, doc_tokens = _prepare_docs(fetched)
+        ranked_idx = _do_rerank(docs, doc_tokens, query, min(5, len(docs)))
+        return self._compose(query, fetched, ranked_idx)
+
+    async def handle_query_async(self, query:str, user_prefers_search:Optional[bool]=None) -> Dict:
+        """Event-loop-friendly entry point: search+fetch runs in a thread
+        (it's I/O-bound) and reranking runs in the process pool, so a slow
+        TF-IDF fit on one large page can't stall other connections."""
+        do_search = planner.should_search(query, user_prefers_search)
+        if not do_search:
+            logger.info("Planner decided not to search; returning model knowledge (simulated)")
+            return {"answer": f"(model-only) I think: {query}", "citations": [], "confidence": 0.4}
+
+        loop = asyncio.get_running_loop()
+        fetched = await loop.run_in_executor(None, self._search_and_fetch, query)
+        if not fetched:
+            return {"answer":"No fetchable sources found.","citations":[],"confidence":0.2}
+        docs, doc_tokens = _prepare_docs(fetched)
+        ranked_idx = await _rerank_batcher.rank(docs, doc_tokens, query, min(5, len(docs)))
+        return self._compose(query, fetched, ranked_idx)
+
+    def _search_and_fetch(self, query:str) -> List[Dict]:
+        # Fire both connectors at once; prefer Google but have the SerpAPI
+        # result already in flight instead of starting it after Google fails
+        google_future = self.fetch_pool.submit(self.google.search, query, 6)
+        serp_future = self.fetch_pool.submit(self.serp.search, query, 6)
+        try:
+            results = google_future.result()
+        except Exception as e:
+            logger.error(f"Google search raised: {e}")
+            results = []
+        if results:
+            serp_future.cancel()
+        else:
+            try:
+                results = serp_future.result()
+            except Exception as e:
+                logger.error(f"SerpAPI search raised: {e}")
+                results = []
+        results = dedupe_snippets(results)
+        fetched = []
+        candidates = [(r, r.get("link") or r.get("url")) for r in results[:6]]
+        candidates = [(r, url) for r, url in candidates if url]
+        # executor.map preserves result order
+        pages = list(self.fetch_pool.map(self.fetcher.fetch, [url for _, url in candidates]))
+        for (r, url), page in zip(candidates, pages):
+            if page.get("status") in ("blocked","error","skipped"):
+                continue
+            content = page.get("content","")
+            extracted = self.extractor.extract(content, url=url)
+            
+            injections = pi_detector.detect(content)
+            if injections and len(injections) > 1: 
+                logger.warning("Multiple prompt injection patterns detected in %s: %s", url, injections)
+                continue
+            elif injections:
+                logger.info("Minor injection pattern detected in %s: %s (proceeding anyway)", url, injections)
+            r2 = r.copy()
+            r2.update({
+                "text": extracted.get("text",""),
+                "title_extracted": extracted.get("title"),
+                "tokens": extracted.get("tokens") or []
+            })
+            fetched.append(r2)
+        return fetched
+
+    def _compose(self, query:str, fetched:List[Dict], ranked_idx:List[Tuple[int,float]]) -> Dict:
+        ranked_items = [fetched[i] for i,score in ranked_idx]
+        used_spans=[]
+        # One compiled alternation over the top query terms; each chunk is
+        # scanned once in C instead of a per-term per-token Python loop
+        q_terms = [t for t in re.findall(r"\w+", query.lower()) if len(t)>2][:3]
+        q_re = re.compile(r"\b(" + "|".join(re.escape(t) for t in q_terms) + r")") if q_terms else None
+        for it in ranked_items:
+            txt = it.get("text","")
+            # Chunk over the extractor's tokens (already lowercased), so
+            # the span scan below needn't lower() every chunk again
+            chunks = chunk_text(txt, chunk_size=250, overlap=40, words=it.get("tokens") or None)
+
+            found_span=None
+            if q_re:
+                for ch in chunks:
+                    matched = {m.group(1) for m in q_re.finditer(ch)}
+                    if len(matched) == len(q_terms):
+                        found_span = ch[:500]
+                        break
+            if not found_span and chunks:
+                found_span = chunks[0][:500]
+            used_spans.append((it.get("link") or it.get("url"), found_span))
+        answer_obj = compose_answer(query, ranked_items, used_spans)
+        answer_obj["model"] = "simulated (compose)"
+        answer_obj["generated_at"] = datetime.datetime.now(datetime.UTC).isoformat()+"Z"
+        return answer_obj
+
+orch = Orchestrator(policy)
+
+def example():
+    q = "Where is TamilNadu located?"
+    print("Query:", q)
+    res = orch.handle_query(q)
+    print("\n--- SYNTHESIZED ANSWER ---")
+    print(res["answer"])
+    print("\n--- CITATIONS ---")
+    print(json.dumps(res["citations"], indent=2))
+    print("\nConfidence:", res["confidence"])
+
+if __name__ == "__main__":
     example()
\ No newline at end of file